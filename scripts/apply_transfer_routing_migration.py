@@ -5,7 +5,8 @@ Uses REST API approach as per CLAUDE.md guidelines
 """
 
 import os
-from supabase import create_client, Client
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Load environment variables
 SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -15,7 +16,30 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
     print("Error: SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
     exit(1)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+@functools.lru_cache(maxsize=1)
+def get_supabase():
+    """Supabase client, imported and created on first use and reused afterwards"""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+
+# Columns added by the migration, with the SQL to add each one manually
+EXPECTED_COLUMNS = [
+    ('clients', 'primary_transfer_type', "ALTER TABLE clients ADD COLUMN primary_transfer_type VARCHAR(20) DEFAULT 'pstn';"),
+    ('clients', 'aircall_sip_number', "ALTER TABLE clients ADD COLUMN aircall_sip_number VARCHAR(50);"),
+    ('call_logs', 'transfer_type', "ALTER TABLE call_logs ADD COLUMN transfer_type VARCHAR(20);"),
+]
+
+
+def column_exists(table, column):
+    """Test column existence by selecting it through PostgREST"""
+    try:
+        get_supabase().table(table).select(column).limit(1).execute()
+        return True
+    except Exception:
+        return False
+
 
 print("Applying transfer routing migration...")
 
@@ -32,38 +56,54 @@ with open(migration_path, 'r') as f:
 # Execute SQL using Supabase RPC
 try:
     # Use supabase.postgrest to execute raw SQL
-    result = supabase.rpc('exec_sql', {'sql': sql_content}).execute()
+    result = get_supabase().rpc('exec_sql', {'sql': sql_content}).execute()
     print("✅ Migration applied successfully!")
     print(f"Result: {result.data}")
 except Exception as e:
     print(f"❌ Migration failed: {e}")
-    print("\nTrying alternative approach with individual column tests...")
+    print("\nChecking which columns already exist...")
 
-    # Test column existence by attempting update on dummy record
-    # This follows the progressive fallback pattern from CLAUDE.md
-    try:
-        # Test if primary_transfer_type column exists
-        test_result = supabase.table("clients").select("primary_transfer_type").limit(1).execute()
-        print("✅ primary_transfer_type column already exists")
-    except Exception:
-        print("⚠️ primary_transfer_type column needs to be added manually")
-        print("   SQL: ALTER TABLE clients ADD COLUMN primary_transfer_type VARCHAR(20) DEFAULT 'pstn';")
+    # PostgREST answers PGRST202 when there is no exec_sql function to call at all
+    exec_sql_missing = getattr(e, 'code', None) == 'PGRST202' or 'Could not find the function' in str(e)
+    existing = None
 
-    try:
-        # Test if aircall_sip_number column exists
-        test_result = supabase.table("clients").select("aircall_sip_number").limit(1).execute()
-        print("✅ aircall_sip_number column already exists")
-    except Exception:
-        print("⚠️ aircall_sip_number column needs to be added manually")
-        print("   SQL: ALTER TABLE clients ADD COLUMN aircall_sip_number VARCHAR(50);")
+    if not exec_sql_missing:
+        try:
+            # One information_schema query answers every column in a single round-trip
+            wanted = ", ".join(f"('{table}', '{column}')" for table, column, _ in EXPECTED_COLUMNS)
+            result = get_supabase().rpc('exec_sql', {
+                'sql': "SELECT table_name, column_name FROM information_schema.columns "
+                       f"WHERE table_schema = 'public' AND (table_name, column_name) IN ({wanted})"
+            }).execute()
 
-    try:
-        # Test if transfer_type column exists in call_logs
-        test_result = supabase.table("call_logs").select("transfer_type").limit(1).execute()
-        print("✅ transfer_type column already exists")
-    except Exception:
-        print("⚠️ transfer_type column needs to be added manually")
-        print("   SQL: ALTER TABLE call_logs ADD COLUMN transfer_type VARCHAR(20);")
+            # Some exec_sql variants return [] or a status for every statement instead of
+            # its rows; only trust a result that actually contains column rows
+            if not isinstance(result.data, list) or not result.data or not all(
+                isinstance(row, dict) and 'table_name' in row and 'column_name' in row
+                for row in result.data
+            ):
+                raise ValueError(f"Unexpected exec_sql result: {result.data}")
+
+            existing = {(row['table_name'], row['column_name']) for row in result.data}
+        except Exception:
+            pass
+
+    if existing is None:
+        # exec_sql unavailable - probe each column instead, all in parallel
+        # This follows the progressive fallback pattern from CLAUDE.md
+        with ThreadPoolExecutor(max_workers=len(EXPECTED_COLUMNS)) as executor:
+            futures = {
+                executor.submit(column_exists, table, column): (table, column)
+                for table, column, _ in EXPECTED_COLUMNS
+            }
+            existing = {futures[future] for future in as_completed(futures) if future.result()}
+
+    for table, column, sql in EXPECTED_COLUMNS:
+        if (table, column) in existing:
+            print(f"✅ {column} column already exists")
+        else:
+            print(f"⚠️ {column} column needs to be added manually")
+            print(f"   SQL: {sql}")
 
     print("\n📋 Please apply the migration SQL manually via Supabase Dashboard:")
     print("   Dashboard → SQL Editor → New query → Paste migration SQL")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Compile .env into scripts/_env.py so the Python scripts don't re-parse .env on every run
+
+Usage:
+  python scripts/gen_env.py              # Compile .env from the repo root
+  python scripts/gen_env.py path/to/.env # Compile a specific env file
+
+Re-run after editing .env. The generated module only sets variables that are
+not already present, so real environment variables still win (same as
+dotenv.load_dotenv()). It records the mtime of .env and raises ImportError
+instead of loading if .env has been modified since, so scripts fall back to
+reading .env rather than using stale (e.g. rotated) keys.
+scripts/_env.py contains secrets and is git-ignored.
+"""
+import os
+import sys
+from dotenv import dotenv_values
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.join(SCRIPTS_DIR, '_env.py')
+
+
+def main():
+    env_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(SCRIPTS_DIR), '.env')
+
+    if not os.path.exists(env_path):
+        print(f"ERROR: {env_path} not found")
+        sys.exit(1)
+
+    # Taken before parsing, so an edit made while we read counts as newer
+    source_path = os.path.abspath(env_path)
+    source_mtime = os.path.getmtime(source_path)
+    values = dotenv_values(env_path)
+
+    lines = [
+        f"# Generated by scripts/gen_env.py from {os.path.basename(env_path)} - do not edit or commit",
+        "import os",
+        "",
+        f"ENV_SOURCE = {source_path!r}",
+        f"ENV_SOURCE_MTIME = {source_mtime!r}",
+        "",
+        "try:",
+        "    _stale = os.path.getmtime(ENV_SOURCE) > ENV_SOURCE_MTIME",
+        "except OSError:",
+        "    _stale = False",
+        "",
+        "if _stale:",
+        "    raise ImportError(f'{ENV_SOURCE} is newer than _env.py')",
+        ""
+    ]
+    header_lines = len(lines)
+
+    for key, value in values.items():
+        if value is not None:
+            lines.append(f"os.environ.setdefault({key!r}, {value!r})")
+
+    # Owner-only permissions, the snapshot holds the same secrets as .env
+    fd = os.open(OUTPUT_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    print(f"✅ Wrote {len(lines) - header_lines} variable(s) to {OUTPUT_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,21 +3,37 @@
 Sync Ultravox agent templates from Supabase clients table
 
 Usage:
-  python sync-ultravox-agents.py                    # Sync all agents
+  python sync-ultravox-agents.py                    # Sync agents flagged prompt_needs_sync
+  python sync-ultravox-agents.py --force            # Sync all agents, even if already synced
   python sync-ultravox-agents.py --agent-id abc123  # Sync specific agent
   python sync-ultravox-agents.py --client-name "Humber Vet"  # Sync by client name
   python sync-ultravox-agents.py --dry-run          # Preview changes without applying
+  python sync-ultravox-agents.py --concurrency 8    # Limit simultaneous Ultravox syncs
 """
 import os
 import sys
-import json
+import hashlib
+import asyncio
 import argparse
-import requests
-from datetime import datetime
-from supabase import create_client, Client
-import dotenv
-
-dotenv.load_dotenv()
+import functools
+import aiohttp
+import orjson
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+try:
+    # Compiled snapshot of .env (see gen_env.py), avoids parsing .env on every run
+    import _env  # noqa: F401
+except ImportError as e:
+    if not isinstance(e, ModuleNotFoundError):
+        # The snapshot refuses to load once .env has been edited after gen_env.py ran
+        print(f"⚠️  {e}, reading .env instead (re-run scripts/gen_env.py)")
+    try:
+        import dotenv
+        dotenv.load_dotenv()
+    except ImportError:
+        # Deployed environments (Railway) inject variables directly
+        pass
 
 # Load environment variables
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
@@ -30,8 +46,43 @@ if not all([SUPABASE_URL, SUPABASE_SERVICE_KEY, ULTRAVOX_API_KEY]):
     print("  SUPABASE_URL, SUPABASE_SERVICE_KEY, ULTRAVOX_API_KEY")
     sys.exit(1)
 
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+@functools.lru_cache(maxsize=1)
+def get_supabase():
+    """Supabase client, imported and created on first use (not needed for --help)"""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+
+# Columns read by sync_agent / get_tools_for_client
+CLIENT_COLUMNS = (
+    'id,name,ultravox_agent_id,system_prompt,agent_voice,corpus_id,corpus_max_results,'
+    'prompt_needs_sync,ultravox_etag,ultravox_voice,prompt_sha256,tools_sha256'
+)
+
+# Clients are fetched from Supabase in pages of this size
+CLIENT_PAGE_SIZE = 500
+
+# Client ids per id=in.(...) filter; 100 UUIDs keep the PostgREST URL under ~4 KB
+ID_FILTER_CHUNK_SIZE = 100
+
+# Default maximum number of agents synced at once (keeps us under Ultravox rate limits)
+SYNC_CONCURRENCY = 16
+
+ULTRAVOX_AGENTS_URL = 'https://api.ultravox.ai/api/agents'
+
+# Keep-alive pool shared by all Ultravox calls, so TLS handshakes are reused across clients
+ULTRAVOX_POOL_SIZE = 32
+
+# Returned by get_ultravox_agent when Ultravox answers 304 to a conditional GET
+NOT_MODIFIED = object()
+
+# Transient Ultravox responses are retried with exponential backoff,
+# or after the server's Retry-After (capped) when it sends one
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.5
+MAX_RETRY_AFTER = 60
 
 # Durable tool IDs from Ultravox
 # Map of tool names (as referenced in prompts) to their tool IDs
@@ -55,101 +106,180 @@ CORE_TOOLS = [
 # Commonly referenced tools that should be auto-enabled if in prompt
 # (These are detected automatically, no need to add to CORE_TOOLS unless they should ALWAYS be enabled)
 
+# Tool sets are handled as bitmasks: bit i is set when the i-th ULTRAVOX_TOOLS entry is enabled
+_TOOL_TABLE = tuple(ULTRAVOX_TOOLS.items())  # (name, tool_id) by bit index
+_TOOL_INDEX = {name: index for index, (name, _) in enumerate(_TOOL_TABLE)}
+_CORE_MASK = sum(1 << _TOOL_INDEX[name] for name in CORE_TOOLS)
+_QUERY_CORPUS_BIT = 1 << _TOOL_INDEX['queryCorpus']
+
+
+def canonical_json(obj):
+    """Canonical (sorted-key) JSON bytes, used to compare tool lists"""
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
 
 def detect_tools_from_prompt(system_prompt):
     """
     Scan the system prompt to detect which tools are referenced.
-    Returns a set of tool names that should be enabled.
+    Returns a bitmask (see _TOOL_INDEX) of tools that should be enabled.
     """
-    detected_tools = set()
+    mask = 0
 
-    for tool_name in ULTRAVOX_TOOLS.keys():
+    # One str.find per tool name beats a combined regex, which is tried at every offset
+    for index, (tool_name, _) in enumerate(_TOOL_TABLE):
         if tool_name in system_prompt:
-            detected_tools.add(tool_name)
+            mask |= 1 << index
 
-    return detected_tools
+    return mask
 
 
-def get_tools_for_client(client_data):
+def get_tools_for_client(client_data, log=print):
     """
     Get tools that should be configured for this client.
     Automatically detects tools from system prompt and adds corpus tool if configured.
 
-    Returns list of tool configurations for Ultravox API.
+    Returns (tools, tools_json): the list of tool configurations for Ultravox API
+    and its canonical JSON bytes for diffing against the current agent.
     """
-    system_prompt = client_data.get('system_prompt', '')
+    tools, tools_json, notes = _build_tools(
+        client_data.get('system_prompt', ''),
+        client_data.get('corpus_id'),
+        client_data.get('corpus_max_results', 5)
+    )
 
-    # Start with core tools (always included)
-    enabled_tools = set(CORE_TOOLS)
+    for note in notes:
+        log(note)
 
-    # Auto-detect tools from system prompt
-    detected_tools = detect_tools_from_prompt(system_prompt)
-    enabled_tools.update(detected_tools)
+    return tools, tools_json
+
+
+@functools.lru_cache(maxsize=256)
+def _build_tools(system_prompt, corpus_id, corpus_max_results):
+    """
+    Build tool configurations for a prompt/corpus combination.
+    Cached because many clients share the same prompt template; log lines are
+    returned rather than printed so they are still shown on cache hits.
+    """
+    # Core tools (always included) plus tools auto-detected from the system prompt
+    detected_mask = detect_tools_from_prompt(system_prompt)
+    enabled_mask = _CORE_MASK | detected_mask
 
     # Build tool configurations
     tools = []
+    notes = []
 
-    for tool_name in enabled_tools:
-        if tool_name not in ULTRAVOX_TOOLS:
-            print(f"  ⚠️  Unknown tool referenced: {tool_name}")
-            continue
+    # Walk the set bits from lowest to highest
+    while enabled_mask:
+        bit = enabled_mask & -enabled_mask
+        enabled_mask ^= bit
 
-        tool_id = ULTRAVOX_TOOLS[tool_name]
+        tool_name, tool_id = _TOOL_TABLE[bit.bit_length() - 1]
 
         # Special handling for queryCorpus - needs corpus_id parameter
-        if tool_name == 'queryCorpus':
-            corpus_id = client_data.get('corpus_id')
+        if bit & _QUERY_CORPUS_BIT:
             if not corpus_id:
-                print(f"  ⚠️  queryCorpus referenced in prompt but no corpus_id configured")
+                notes.append(f"  ⚠️  queryCorpus referenced in prompt but no corpus_id configured")
                 continue
 
-            print(f"  📚 Adding queryCorpus tool with corpus_id: {corpus_id}")
+            notes.append(f"  📚 Adding queryCorpus tool with corpus_id: {corpus_id}")
             tools.append({
                 "toolId": tool_id,
                 "parameterOverrides": {
                     "corpus_id": corpus_id,
-                    "max_results": int(client_data.get('corpus_max_results', 5))
+                    "max_results": int(corpus_max_results)
                 }
             })
         else:
             # Standard tool - no parameters needed
-            if tool_name in detected_tools and tool_name not in CORE_TOOLS:
-                print(f"  🔧 Auto-detected tool from prompt: {tool_name}")
+            if bit & detected_mask & ~_CORE_MASK:
+                notes.append(f"  🔧 Auto-detected tool from prompt: {tool_name}")
             tools.append({"toolId": tool_id})
 
-    return tools
+    return tools, canonical_json(tools), tuple(notes)
 
 
-def get_ultravox_agent(agent_id):
-    """Fetch current agent template from Ultravox"""
-    url = f"https://api.ultravox.ai/api/agents/{agent_id}"
-    headers = {
-        'X-API-Key': ULTRAVOX_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 404:
-        return None
-    else:
-        raise Exception(f"Failed to fetch agent {agent_id}: {response.status_code} {response.text}")
+def create_ultravox_session(pool_size=ULTRAVOX_POOL_SIZE):
+    """Create the HTTP session shared by all Ultravox calls in a run"""
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={
+            'X-API-Key': ULTRAVOX_API_KEY,
+            'Content-Type': 'application/json'
+        }
+    )
 
 
-def update_ultravox_agent(agent_id, system_prompt, voice=None, tools=None):
-    """Update Ultravox agent template"""
-    url = f"https://api.ultravox.ai/api/agents/{agent_id}"
-    headers = {
-        'X-API-Key': ULTRAVOX_API_KEY,
-        'Content-Type': 'application/json'
-    }
+def retry_delay(response, attempt):
+    """Seconds to wait before retry number attempt + 1"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
 
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_AFTER)
+
+    return RETRY_BACKOFF * (2 ** attempt)
+
+
+async def ultravox_request(session, method, url, **kwargs):
+    """
+    Send a request to Ultravox, retrying connection errors and transient statuses.
+    The body is read before returning, so response.json()/text() can be awaited afterwards.
+    The retry sleep happens inside the calling sync worker, so a rate-limited
+    Ultravox also slows down the rest of the fan-out.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                await response.read()
+        except aiohttp.ClientConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+
+        await asyncio.sleep(retry_delay(response, attempt))
+
+
+async def get_ultravox_agent(session, agent_id, etag=None):
+    """
+    Fetch current agent template from Ultravox.
+    Returns (agent, etag); agent is None if not found, or NOT_MODIFIED if the
+    given etag still matches.
+    """
+    headers = {'If-None-Match': etag} if etag else None
+    response = await ultravox_request(session, 'GET', f"{ULTRAVOX_AGENTS_URL}/{agent_id}", headers=headers)
+
+    if response.status == 200:
+        return await response.json(), response.headers.get('ETag')
+    elif response.status == 304:
+        return NOT_MODIFIED, etag
+    elif response.status == 404:
+        return None, None
+    else:
+        raise Exception(f"Failed to fetch agent {agent_id}: {response.status} {await response.text()}")
+
+
+async def update_ultravox_agent(session, agent_id, system_prompt=None, voice=None, tools=None):
+    """
+    Update Ultravox agent template. Only the fields passed are sent.
+    Returns (agent, etag).
+    """
     # CRITICAL: All fields must be wrapped in callTemplate object
-    call_template = {
-        'systemPrompt': system_prompt
-    }
+    call_template = {}
+
+    if system_prompt is not None:
+        call_template['systemPrompt'] = system_prompt
 
     if voice:
         call_template['voice'] = voice
@@ -161,105 +291,337 @@ def update_ultravox_agent(agent_id, system_prompt, voice=None, tools=None):
         'callTemplate': call_template
     }
 
-    response = requests.patch(url, headers=headers, json=payload)
+    response = await ultravox_request(session, 'PATCH', f"{ULTRAVOX_AGENTS_URL}/{agent_id}", json=payload)
 
-    if response.status_code in [200, 201]:
-        return response.json()
+    if response.status in [200, 201]:
+        return await response.json(), response.headers.get('ETag')
     else:
-        raise Exception(f"Failed to update agent {agent_id}: {response.status_code} {response.text}")
+        raise Exception(f"Failed to update agent {agent_id}: {response.status} {await response.text()}")
+
+
+def sync_fingerprints(system_prompt, voice, tools_json):
+    """
+    Fingerprint of the agent configuration pushed to Ultravox, stored after each sync:
+    SHA-256 of the prompt and tools, and the voice as is (it's only a name).
+    Comparing the fields one by one tells which part changed when Ultravox
+    confirms (304) it still holds what was last pushed.
+    """
+    return {
+        'prompt_sha256': hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(),
+        'tools_sha256': hashlib.sha256(tools_json).hexdigest(),
+        'ultravox_voice': voice
+    }
+
+
+async def sync_agent(session, client_data, run_ts, dry_run=False, force=False):
+    """
+    Sync a single agent (see _sync_agent).
+    Log lines are buffered and written as one block when the client finishes, so
+    concurrent syncs don't interleave. A single write between awaits can't be
+    interrupted by another coroutine, so no lock is needed.
+    """
+    out = []
+    try:
+        return await _sync_agent(session, client_data, run_ts, out.append, dry_run, force)
+    finally:
+        if out:
+            sys.stdout.write('\n'.join(out) + '\n')
 
 
-def sync_agent(client_data, dry_run=False):
-    """Sync a single agent"""
+async def _sync_agent(session, client_data, run_ts, log, dry_run=False, force=False):
+    """
+    Sync a single agent.
+    Unless force is set, clients whose config matches the fingerprint stored at
+    their last sync are not re-fetched: with a stored ETag a conditional GET is
+    sent, and without one (Ultravox sent none) the GET is skipped entirely.
+    If the config changed and Ultravox answers a conditional GET with 304, the
+    changed fields are found from the stored fingerprint without reading the agent.
+    """
+    client_id = client_data.get('id')
     agent_id = client_data.get('ultravox_agent_id')
     client_name = client_data.get('name')
     system_prompt = client_data.get('system_prompt')
     agent_voice = client_data.get('agent_voice') or 'Jessica'
     
     if not agent_id:
-        print(f"⚠️  {client_name}: No ultravox_agent_id configured")
+        log(f"⚠️  {client_name}: No ultravox_agent_id configured")
         return {'status': 'skipped', 'reason': 'no_agent_id'}
     
     if not system_prompt:
-        print(f"⚠️  {client_name}: No system_prompt in database")
+        log(f"⚠️  {client_name}: No system_prompt in database")
         return {'status': 'skipped', 'reason': 'no_system_prompt'}
     
-    print(f"\n{'[DRY RUN] ' if dry_run else ''}Syncing {client_name}...")
-    print(f"  Agent ID: {agent_id}")
-    print(f"  Voice: {agent_voice}")
-    print(f"  Prompt length: {len(system_prompt)} chars")
+    log(f"\n{'[DRY RUN] ' if dry_run else ''}Syncing {client_name}...")
+    log(f"  Agent ID: {agent_id}")
+    log(f"  Voice: {agent_voice}")
+    log(f"  Prompt length: {len(system_prompt)} chars")
     
     try:
-        # Fetch current Ultravox agent
-        current_agent = get_ultravox_agent(agent_id)
-        
-        if not current_agent:
-            print(f"  ❌ Agent {agent_id} not found in Ultravox")
-            return {'status': 'error', 'reason': 'agent_not_found'}
-        
-        current_prompt = current_agent.get('systemPrompt', '')
-        current_voice = current_agent.get('voice', '')
-        current_tools = current_agent.get('callTemplate', {}).get('selectedTools', [])
-
         # Get tools for this client (auto-detected from prompt + corpus if configured)
-        standard_tools = get_tools_for_client(client_data)
+        standard_tools, standard_tools_json = get_tools_for_client(client_data, log)
+
+        fingerprints = sync_fingerprints(system_prompt, agent_voice, standard_tools_json)
+        stored_etag = client_data.get('ultravox_etag')
+        stored = {field: client_data.get(field) for field in fingerprints}
+        unchanged_since_sync = not force and stored == fingerprints
+        has_fingerprint = all(stored.values())
+        # agent_voice is the raw column value, compared by mark_agents_synced() to catch edits made mid-run
+        in_sync = {
+            'status': 'already_synced',
+            'client_id': client_id,
+            'etag': stored_etag,
+            'fingerprints': fingerprints,
+            'agent_voice': client_data.get('agent_voice')
+        }
+
+        if unchanged_since_sync and not stored_etag:
+            log(f"  ✓ {client_name}: Already in sync (unchanged since last sync)")
+            return in_sync
+
+        # Fetch current Ultravox agent (conditionally, if we can diff without its body)
+        conditional = not force and has_fingerprint
+        current_agent, etag = await get_ultravox_agent(
+            session,
+            agent_id,
+            etag=stored_etag if conditional else None
+        )
 
-        # Check if update needed
-        prompt_changed = current_prompt != system_prompt
-        voice_changed = current_voice != agent_voice
-        tools_changed = json.dumps(current_tools, sort_keys=True) != json.dumps(standard_tools, sort_keys=True)
+        if current_agent is NOT_MODIFIED and unchanged_since_sync:
+            log(f"  ✓ {client_name}: Already in sync (not modified)")
+            return in_sync
 
-        if not prompt_changed and not voice_changed and not tools_changed:
-            print(f"  ✓ Already in sync")
-            return {'status': 'already_synced'}
+        if current_agent is NOT_MODIFIED:
+            # Ultravox still holds what was last pushed, so diff against the stored fingerprint
+            prompt_changed = stored['prompt_sha256'] != fingerprints['prompt_sha256']
+            tools_changed = stored['tools_sha256'] != fingerprints['tools_sha256']
+            voice_changed = stored['ultravox_voice'] != agent_voice
 
-        if prompt_changed:
-            print(f"  📝 Prompt changed ({len(current_prompt)} → {len(system_prompt)} chars)")
-        if voice_changed:
-            print(f"  🔊 Voice changed ({current_voice} → {agent_voice})")
-        if tools_changed:
-            print(f"  🔧 Tools changed ({len(current_tools)} → {len(standard_tools)} tools)")
+            log(f"  📝 {client_name}: Changed since last sync (not modified in Ultravox)")
+        else:
+            if not current_agent:
+                log(f"  ❌ {client_name}: Agent {agent_id} not found in Ultravox")
+                return {'status': 'error', 'reason': 'agent_not_found'}
+
+            current_prompt = current_agent.get('systemPrompt', '')
+            current_voice = current_agent.get('voice', '')
+            current_tools = current_agent.get('callTemplate', {}).get('selectedTools', [])
+
+            # Check if update needed
+            prompt_changed = current_prompt != system_prompt
+            voice_changed = current_voice != agent_voice
+            tools_changed = canonical_json(current_tools) != standard_tools_json
+
+            if not prompt_changed and not voice_changed and not tools_changed:
+                log(f"  ✓ {client_name}: Already in sync")
+                return {**in_sync, 'etag': etag}
+
+            if prompt_changed:
+                log(f"  📝 {client_name}: Prompt changed ({len(current_prompt)} → {len(system_prompt)} chars)")
+            if voice_changed:
+                log(f"  🔊 {client_name}: Voice changed ({current_voice} → {agent_voice})")
+            if tools_changed:
+                log(f"  🔧 {client_name}: Tools changed ({len(current_tools)} → {len(standard_tools)} tools)")
 
         if dry_run:
-            print(f"  [DRY RUN] Would update agent template")
+            log(f"  [DRY RUN] {client_name}: Would update agent template")
             return {'status': 'would_update', 'dry_run': True}
 
-        # Update Ultravox
-        updated_agent = update_ultravox_agent(
+        # Update Ultravox, sending only the fields that changed
+        updated_agent, etag = await update_ultravox_agent(
+            session,
             agent_id,
-            system_prompt,
-            agent_voice,
+            system_prompt=system_prompt if prompt_changed else None,
+            voice=agent_voice if voice_changed else None,
             tools=standard_tools if tools_changed else None
         )
 
-        # Mark as synced in database
-        client_id = client_data.get('id')
-        if client_id:
-            try:
-                supabase.table('clients').update({
-                    'prompt_needs_sync': False,
-                    'prompt_last_synced': datetime.now().isoformat(),
-                    'prompt_sync_error': None
-                }).eq('id', client_id).execute()
-                print(f"  ✅ Successfully synced and marked as synced in database")
-            except Exception as db_err:
-                print(f"  ⚠️  Synced to Ultravox but failed to update database: {str(db_err)}")
-
-        return {'status': 'success', 'updated_at': datetime.now().isoformat()}
+        log(f"  ✅ {client_name}: Successfully synced")
+        return {
+            'status': 'success',
+            'client_id': client_id,
+            'etag': etag,
+            'fingerprints': fingerprints,
+            'agent_voice': client_data.get('agent_voice'),
+            'updated_at': run_ts
+        }
         
     except Exception as e:
-        print(f"  ❌ Error: {str(e)}")
+        log(f"  ❌ {client_name}: Error: {str(e)}")
         return {'status': 'error', 'error': str(e)}
 
 
+def mark_clients_synced(synced, run_ts):
+    """
+    Clear prompt_needs_sync and record the ETag/fingerprints for a batch of synced
+    clients with one mark_agents_synced() call (add_bulk_agent_sync_mark.sql).
+    That function keeps prompt_needs_sync set for clients whose prompt or voice
+    was edited after this run read them, so the edit is synced next run.
+    """
+    rows = [{
+        'id': result['client_id'],
+        'ultravox_etag': result['etag'],
+        'agent_voice': result['agent_voice'],
+        **result['fingerprints']
+    } for result in synced]
+
+    try:
+        get_supabase().rpc('mark_agents_synced', {'synced_at': run_ts, 'synced': rows}).execute()
+        print(f"✅ Marked {len(rows)} client(s) as synced in database")
+        return
+    except Exception as rpc_err:
+        print(f"⚠️  mark_agents_synced() failed, falling back to plain updates: {str(rpc_err)}")
+
+    # Without the function, a prompt edited since it was read still has its
+    # prompt_needs_sync cleared here, and waits for the next --force run
+    ids = [row['id'] for row in rows]
+
+    for start in range(0, len(ids), ID_FILTER_CHUNK_SIZE):
+        chunk = ids[start:start + ID_FILTER_CHUNK_SIZE]
+        try:
+            get_supabase().table('clients').update({
+                'prompt_needs_sync': False,
+                'prompt_last_synced': run_ts,
+                'prompt_sync_error': None
+            }).in_('id', chunk).execute()
+        except Exception as db_err:
+            print(f"⚠️  Synced {len(chunk)} client(s) to Ultravox but failed to update database: {str(db_err)}")
+
+    # ETag and fingerprints differ per client, so these are written one by one
+    for row in rows:
+        client_id = row.pop('id')
+        row.pop('agent_voice')
+        try:
+            get_supabase().table('clients').update(row).eq('id', client_id).execute()
+        except Exception as db_err:
+            print(f"⚠️  Client {client_id}: Synced to Ultravox but failed to store fingerprints: {str(db_err)}")
+
+
+def fetch_clients_page(filters, after_id=None, page_size=CLIENT_PAGE_SIZE):
+    """Fetch the page of clients after after_id matching the (column, value) equality filters"""
+    query = get_supabase().table('clients').select(CLIENT_COLUMNS)
+
+    for column, value in filters:
+        query = query.eq(column, value)
+
+    # Keyset paging on id: synced clients are marked per page and drop out of the
+    # prompt_needs_sync filter, which would shift offsets and skip rows
+    if after_id is not None:
+        query = query.gt('id', after_id)
+
+    return query.order('id').limit(page_size).execute().data
+
+
+async def iter_clients(filters, page_size=CLIENT_PAGE_SIZE):
+    """
+    Yield clients page by page rather than loading the whole table in one response.
+    The next page is requested before the current one is handed out; sync_all's
+    queue puts block while workers are busy, so the fetch runs during in-flight
+    syncs and at most one page is fetched ahead.
+    """
+    def prefetch(after_id):
+        # supabase-py is sync, so fetch off the event loop to let in-flight syncs progress
+        return asyncio.create_task(asyncio.to_thread(fetch_clients_page, filters, after_id, page_size))
+
+    next_page = prefetch(None)
+
+    try:
+        while next_page:
+            batch = await next_page
+
+            if len(batch) == page_size:
+                next_page = prefetch(batch[-1]['id'])
+            else:
+                next_page = None
+
+            if batch:
+                print(f"\nFetched {len(batch)} client(s) to sync")
+
+            for client in batch:
+                yield client
+    finally:
+        if next_page:
+            next_page.cancel()
+
+
+async def sync_all(filters, run_ts, concurrency=SYNC_CONCURRENCY, dry_run=False, force=False,
+                   page_size=CLIENT_PAGE_SIZE):
+    """
+    Sync all matching clients with a fixed pool of concurrency workers.
+    Unless dry_run is set, synced clients are marked in the database a page at a
+    time, so a long run doesn't hold every result until the end.
+    Clients are handed to the workers through a queue of at most page_size entries,
+    so fetching pauses while the workers are behind. At most the queue, one client
+    per worker, the page being queued and the page being prefetched are held in
+    memory at once.
+    """
+    queue = asyncio.Queue(maxsize=page_size)
+    results = []
+    synced = []
+
+    async def flush_synced():
+        batch = synced[:]
+        synced.clear()
+        # supabase-py is sync, so write off the event loop to let in-flight syncs progress
+        await asyncio.to_thread(mark_clients_synced, batch, run_ts)
+
+    async def produce():
+        try:
+            async for client in iter_clients(filters, page_size):
+                await queue.put(client)
+        except Exception as e:
+            # Let the workers finish and mark what they synced; the run still exits 1
+            print(f"\n❌ Failed to fetch clients: {str(e)}")
+            results.append({'status': 'error', 'error': str(e)})
+        finally:
+            # One stop marker per worker, also when fetching failed
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def work(session):
+        while (client := await queue.get()) is not None:
+            # Collect exceptions as results so one failing client doesn't abort the batch
+            try:
+                result = await sync_agent(session, client, run_ts, dry_run=dry_run, force=force)
+            except Exception as e:
+                results.append(e)
+                continue
+
+            results.append(result)
+
+            if not dry_run and result['status'] in ('success', 'already_synced'):
+                synced.append(result)
+                if len(synced) >= page_size:
+                    await flush_synced()
+
+    async with create_ultravox_session(pool_size=max(ULTRAVOX_POOL_SIZE, concurrency)) as session:
+        await asyncio.gather(produce(), *(work(session) for _ in range(concurrency)))
+
+    if synced:
+        await flush_synced()
+
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(description='Sync Ultravox agents from Supabase')
     parser.add_argument('--agent-id', help='Sync specific agent by ultravox_agent_id')
     parser.add_argument('--client-name', help='Sync specific client by name')
     parser.add_argument('--client-id', help='Sync specific client by ID')
     parser.add_argument('--dry-run', action='store_true', help='Preview changes without applying')
+    parser.add_argument('--force', action='store_true',
+                        help='Sync all agents, not just those flagged prompt_needs_sync, and re-check unchanged agents')
+    parser.add_argument('--only-needs-sync', action='store_true',
+                        help='Only sync agents flagged prompt_needs_sync (default unless filtering or --force)')
+    parser.add_argument('--concurrency', type=int, default=SYNC_CONCURRENCY,
+                        help=f'Maximum simultaneous Ultravox syncs (default: {SYNC_CONCURRENCY})')
     
     args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+
+    # One timestamp for the whole run, used for prompt_last_synced and updated_at
+    run_ts = datetime.now(timezone.utc).isoformat()
     
     print("=" * 60)
     print("Ultravox Agent Sync Script")
@@ -268,31 +630,45 @@ def main():
     if args.dry_run:
         print("\n🔍 DRY RUN MODE - No changes will be made\n")
     
-    # Build query
-    query = supabase.table('clients').select('*')
+    # Build filters
+    filters = []
+    targeted = bool(args.agent_id or args.client_name or args.client_id)
     
     if args.agent_id:
-        query = query.eq('ultravox_agent_id', args.agent_id)
+        filters.append(('ultravox_agent_id', args.agent_id))
         print(f"Filtering by agent_id: {args.agent_id}")
     elif args.client_name:
-        query = query.eq('name', args.client_name)
+        filters.append(('name', args.client_name))
         print(f"Filtering by client name: {args.client_name}")
     elif args.client_id:
-        query = query.eq('id', args.client_id)
+        filters.append(('id', args.client_id))
         print(f"Filtering by client ID: {args.client_id}")
-    else:
-        print("Syncing ALL agents")
+    elif args.force and not args.only_needs_sync:
+        print("Syncing ALL agents (--force)")
+
+    # Already-synced clients would only cost a GET to confirm nothing changed, so
+    # untargeted runs skip them unless forced; targeted runs opt in with --only-needs-sync
+    if args.only_needs_sync or not (targeted or args.force):
+        filters.append(('prompt_needs_sync', True))
+        print("Syncing agents flagged prompt_needs_sync")
     
-    # Fetch clients
-    response = query.execute()
-    clients = response.data
+    # Fetch and sync clients
+    outcomes = asyncio.run(sync_all(
+        filters,
+        run_ts,
+        concurrency=args.concurrency,
+        dry_run=args.dry_run,
+        force=args.force
+    ))
     
-    if not clients:
+    if not outcomes:
+        if not targeted:
+            # Nothing flagged for sync is the normal state for a cron re-run
+            print("\n✓ No agents need syncing")
+            sys.exit(0)
         print("\n❌ No clients found matching criteria")
         sys.exit(1)
     
-    print(f"\nFound {len(clients)} client(s) to sync")
-    
     # Sync each client
     results = {
         'success': 0,
@@ -301,11 +677,12 @@ def main():
         'errors': 0,
         'would_update': 0
     }
-    
-    for client in clients:
-        result = sync_agent(client, dry_run=args.dry_run)
-        
-        if result['status'] == 'success':
+
+    for result in outcomes:
+        if isinstance(result, Exception):
+            print(f"❌ Unexpected error: {str(result)}")
+            results['errors'] += 1
+        elif result['status'] == 'success':
             results['success'] += 1
         elif result['status'] == 'already_synced':
             results['already_synced'] += 1
@@ -0,0 +1,47 @@
+-- Migration: Mark a batch of agents as synced in one call
+-- Purpose: Let sync-ultravox-agents.py record each page of synced clients with a single
+--          statement, without clearing prompt_needs_sync for prompts edited mid-run
+
+-- 1. Create function to mark a batch of clients synced (called by sync script)
+--    synced is a JSON array of objects with id, ultravox_etag, ultravox_voice,
+--    prompt_sha256, tools_sha256 and agent_voice (as read before the sync)
+CREATE OR REPLACE FUNCTION mark_agents_synced(
+  synced_at TIMESTAMPTZ,
+  synced JSONB
+)
+RETURNS INTEGER AS $$
+DECLARE
+  updated_count INTEGER;
+BEGIN
+  UPDATE clients c
+  SET ultravox_etag = s.ultravox_etag,
+      ultravox_voice = s.ultravox_voice,
+      prompt_sha256 = s.prompt_sha256,
+      tools_sha256 = s.tools_sha256,
+      prompt_last_synced = synced_at,
+      prompt_sync_error = NULL,
+      -- If the prompt or voice was edited after the sync read it, the trigger has
+      -- already set prompt_needs_sync again; keep it so the next run pushes the edit
+      prompt_needs_sync = CASE
+        WHEN encode(sha256(convert_to(c.system_prompt, 'UTF8')), 'hex') = s.prompt_sha256
+         AND c.agent_voice IS NOT DISTINCT FROM s.agent_voice
+        THEN FALSE
+        ELSE c.prompt_needs_sync
+      END
+  FROM jsonb_to_recordset(synced) AS s(
+    id UUID,
+    ultravox_etag TEXT,
+    ultravox_voice TEXT,
+    prompt_sha256 TEXT,
+    tools_sha256 TEXT,
+    agent_voice TEXT
+  )
+  WHERE c.id = s.id;
+
+  GET DIAGNOSTICS updated_count = ROW_COUNT;
+  RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 2. Add helpful comments
+COMMENT ON FUNCTION mark_agents_synced(TIMESTAMPTZ, JSONB) IS 'Mark a batch of agents as synced and store their Ultravox ETag/fingerprints (called by sync script)';
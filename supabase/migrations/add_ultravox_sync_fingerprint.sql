@@ -0,0 +1,16 @@
+-- Migration: Track what was last pushed to each Ultravox agent
+-- Purpose: Let sync-ultravox-agents.py skip re-fetching agents that haven't changed,
+--          and tell which fields changed without downloading the agent
+
+-- 1. Add sync fingerprint columns to clients table
+ALTER TABLE clients
+ADD COLUMN IF NOT EXISTS ultravox_etag TEXT,
+ADD COLUMN IF NOT EXISTS ultravox_voice TEXT,
+ADD COLUMN IF NOT EXISTS prompt_sha256 TEXT,
+ADD COLUMN IF NOT EXISTS tools_sha256 TEXT;
+
+-- 2. Add helpful comments
+COMMENT ON COLUMN clients.ultravox_etag IS 'ETag returned by Ultravox for the agent at last sync (sent as If-None-Match on the next sync)';
+COMMENT ON COLUMN clients.ultravox_voice IS 'Voice pushed to Ultravox at last sync';
+COMMENT ON COLUMN clients.prompt_sha256 IS 'SHA-256 of the system prompt pushed to Ultravox at last sync';
+COMMENT ON COLUMN clients.tools_sha256 IS 'SHA-256 of the canonical selectedTools JSON pushed to Ultravox at last sync';